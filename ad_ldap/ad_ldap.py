@@ -34,16 +34,29 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import copy
-import re
-import time
+import asyncio
+import calendar
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import queue
+import sys
+import threading
 from ad_ldap import constants
 from ad_ldap import errors
 import ldap
 import ldap.controls
-import ldap.filter
 import ldap.modlist
 
+# LDAPConnectionPools parked by Domain.Disconnect() when pooling is enabled,
+# with all their connections still bound.  Each is kept in a queue keyed on
+# (ldap_host, user, password hash), so that a pool is only ever handed back to a
+# caller presenting the same credentials.  There are never more parked pools
+# for a key than Domains that were connected with it at once.
+_POOL = {}
+
+
 def ADFileTimeToUnix(ad_time):
   """Converts AD double-wide int format to seconds since the epoch format.
 
@@ -56,7 +69,26 @@ def ADFileTimeToUnix(ad_time):
   Returns:
     An int with the number of seconds since January 1, 1970.
   """
-  return int((ad_time - constants.EPOCH_AS_FILETIME) / 10000000)
+  return (ad_time - constants.EPOCH_AS_FILETIME) // 10000000
+
+
+def ADFileTimeToUnixBulk(ad_times):
+  """Converts many AD double-wide int times to seconds since the epoch.
+
+  This does the same conversion as ADFileTimeToUnix() on a whole sequence at
+  once, which is much faster when processing the lastLogonTimestamp or
+  pwdLastSet values of a large number of objects.  It requires numpy.
+
+  Args:
+    ad_times: a sequence of 64-bit integer times in the format used by AD
+
+  Returns:
+    A numpy array of ints with the number of seconds since January 1, 1970.
+  """
+  import numpy
+
+  ad_times = numpy.asarray(ad_times, dtype=numpy.int64)
+  return (ad_times - constants.EPOCH_AS_FILETIME) // 10000000
 
 
 def ToStr(byte_string):
@@ -88,12 +120,17 @@ def ToBytes(in_string):
   else:
     return bytes(in_string, 'utf-8')
 
+@functools.lru_cache(maxsize=1024)
 def ADTextTimeToUnix(text_time):
   """Converts alternate time format text strings to seconds since the epoch.
 
   Some Active Directory properties are stored in a YYYYMMDDHHMMSS.0Z format.
   See http://msdn.microsoft.com/en-us/library/aa772189(VS.85).aspx for details.
 
+  The values are in UTC, so the result does not depend on the local time zone.
+  The results are cached, since objects created or changed together share the
+  same timestamps.
+
   Args:
     text_time: the string containing the time value.
 
@@ -102,7 +139,7 @@ def ADTextTimeToUnix(text_time):
   """
   groups = constants.RE_TEXT_TIME.findall(text_time)
   time_tuple = tuple([int(x) for x in groups[0] + (0, 0, 0)])
-  return time.mktime(time_tuple)
+  return calendar.timegm(time_tuple)
 
 
 def BitmaskBool(bitmask, value):
@@ -120,16 +157,139 @@ def BitmaskBool(bitmask, value):
   This will return True if the bit is set in user.user_account_control.
 
   Args:
-    bitmask: a number representing a bitmask
-    value:  the value to be checked (usually a known constant)
+    bitmask: an int representing a bitmask
+    value:  the int value to be checked (usually a known constant)
 
   Returns:
     True if the bit has been set, False if it has not.
   """
-  if int(bitmask) & int(value):
-    return True
+  return bool(bitmask & value)
+
+
+def _Snapshot(properties):
+  """Copies a properties dict so later edits can be diffed against it.
+
+  Property values are flat lists of strings, so copying each list is enough
+  and is much cheaper than copy.deepcopy.
+
+  Args:
+    properties: a dict of property names and their lists of values
+
+  Returns:
+    A copy of the dict with each list value copied.
+  """
+  return {k: v[:] if isinstance(v, list) else v
+          for k, v in properties.items()}
+
+
+@functools.lru_cache(maxsize=8192)
+def _ParseDN(distinguished_name):
+  """Splits a distinguished name into its RDNs.
+
+  The results are cached, since the same DNs tend to be parsed repeatedly.
+
+  Args:
+    distinguished_name: the distinguished name as a string
+
+  Returns:
+    A tuple of (attribute type, value) tuples, with the attribute types in
+    lower case, in the order they appear in the DN.
+  """
+  output = []
+
+  for element in constants.RE_DN_SPLIT.split(distinguished_name):
+    match = constants.RE_RDN.match(element)
+
+    if match:
+      output.append((match.group(1).lower(), match.group(2)))
+
+  return tuple(output)
+
+
+def _MissingProps(properties, mandatory):
+  """Works out which properties need to be retrieved for a new ADObject.
+
+  Args:
+    properties: a dict of properties already retrieved, or a list of property
+                names to retrieve
+    mandatory: a frozenset of the property names the object must have
+
+  Returns:
+    For a dict, a list of the mandatory properties it is missing.  For a list,
+    the list itself, extended with any mandatory properties it was missing.
+  """
+  if isinstance(properties, dict):
+    return list(mandatory - properties.keys())
+  elif isinstance(properties, list):
+    properties.extend(mandatory - set(properties))
+    return properties
   else:
-    return False
+    return []
+
+
+def _BuildModlist(new):
+  """Builds an ldap modlist from properties that are already known to differ.
+
+  This does the same job as ldap.modlist.modifyModlist, but SetProperties has
+  already worked out which properties changed, so there is no need to compare
+  every property again.  Every change is a MOD_REPLACE, which creates or
+  overwrites the attribute, or clears it when there are no values.  The
+  snapshot can't tell us whether AD holds a value for a property that was never
+  fetched, so MOD_ADD and MOD_DELETE are not safe to use.
+
+  Args:
+    new: a dict of the new values of the changed properties
+
+  Returns:
+    A list of (operation, property, values) tuples for modify_s.
+  """
+  empty = (None, '', b'')
+  return [(ldap.MOD_REPLACE, prop,
+           [ToBytes(value) for value in values if value not in empty])
+          for prop, values in new.items()]
+
+
+def _DNKey(distinguished_name):
+  """Returns a form of a DN for comparing it with others.
+
+  DNs are case-insensitive, so two DNs name the same object when their keys
+  are equal.  The key is only for comparisons; the DN itself should be kept
+  for writing back to AD.
+
+  Args:
+    distinguished_name: a distinguished name, as str or bytes
+
+  Returns:
+    The DN as a lower-cased str.
+  """
+  return ToStr(distinguished_name).lower()
+
+
+def _Chunks(values, size):
+  """Splits a list into consecutive lists of at most size items.
+
+  Args:
+    values: the list to split
+    size: the largest number of items in each chunk
+
+  Returns:
+    An iterator of lists.
+  """
+  return (values[i:i + size] for i in range(0, len(values), size))
+
+
+def _OrFilter(attribute, values):
+  """Builds an ldap filter matching any of several values of one attribute.
+
+  Args:
+    attribute: the name of the attribute to match
+    values: the (unescaped) values to match
+
+  Returns:
+    The ldap filter string.
+  """
+  return '(|%s)' % ''.join('(%s=%s)' % (attribute, Escape(value))
+                           for value in values)
 
 
 def Escape(text):
@@ -141,7 +301,192 @@ def Escape(text):
   Returns:
     The escaped text.
   """
-  return ldap.filter.escape_filter_chars(ToStr(text))
+  return ToStr(text).translate(constants.LDAP_FILTER_ESCAPES)
+
+
+class LDAPConnectionPool(object):
+  """A bounded pool of bound ldap connections to one server.
+
+  Connections are opened as they are needed, up to size of them, and handed
+  out by Acquire().  A thread that already holds a connection gets the same one
+  back from a nested Acquire(), so objects built while a search is running can
+  make their own ldap calls without waiting on the pool.
+  """
+
+  def __init__(self, uri, bind_dn, password, size=8):
+    """Initialize the pool.
+
+    Args:
+      uri: the ldap URI of the server, e.g. ldaps://dc.example.com
+      bind_dn: the username for authentication
+      password: the password for authentication
+      size: the largest number of connections the pool will hold
+    """
+    self._uri = uri
+    self._bind_dn = bind_dn
+    self._password = password
+    self._size = max(size, 1)
+    self._members = []
+    self._idle = queue.LifoQueue()
+    self._lock = threading.Lock()
+    # Thread ident -> [connection, nesting depth] for each checkout.
+    self._held = {}
+
+  @property
+  def size(self):
+    return self._size
+
+  @size.setter
+  def size(self, size):
+    self._size = max(size, 1)
+
+  def Bind(self):
+    """Opens and binds a new connection to the server.
+
+    The connection is not added to the pool; pass it to Add() for that.
+
+    Returns:
+      A bound ldap connection.
+
+    Raises:
+      errors.LDAPConnectionFailedError: if no ldap connection can be made
+      errors.InvalidCredentialsError: if the ldap credentials are not accepted
+    """
+    try:
+      conn = ldap.initialize(self._uri)
+      conn.protocol_version = 3
+      conn.simple_bind_s(self._bind_dn, self._password)
+      conn.set_option(ldap.OPT_REFERRALS, 0)
+      return conn
+    except ldap.SERVER_DOWN as e:
+      raise errors.LDAPConnectionFailedError(e.args[0]['info'])
+    except ldap.INVALID_CREDENTIALS:
+      raise errors.InvalidCredentialsError
+
+  def Add(self, conn):
+    """Adds a bound connection to the pool as an idle connection.
+
+    Args:
+      conn: a bound ldap connection
+
+    Returns:
+      The connection.
+    """
+    with self._lock:
+      self._members.append(conn)
+
+    self._idle.put(conn)
+    return conn
+
+  @contextlib.contextmanager
+  def Acquire(self):
+    """Checks a connection out of the pool for the duration of a with block.
+
+    If every connection is busy and the pool is full, this waits for one to be
+    released.  The checkout belongs to the thread that entered the block, even
+    if the block is left on another thread, as happens when a generator is
+    resumed or closed elsewhere.
+
+    Yields:
+      A bound ldap connection.
+    """
+    ident = threading.get_ident()
+
+    with self._lock:
+      held = self._held.get(ident)
+
+      if held is not None:
+        held[1] += 1
+
+    if held is None:
+      held = [self._Get(), 1]
+
+      with self._lock:
+        self._held[ident] = held
+
+    try:
+      yield held[0]
+    finally:
+      with self._lock:
+        held[1] -= 1
+        release = not held[1]
+
+        if release:
+          del self._held[ident]
+
+      if release:
+        self._idle.put(held[0])
+
+  def _Get(self):
+    """Takes an idle connection, opening a new one if there is room."""
+    try:
+      return self._idle.get_nowait()
+    except queue.Empty:
+      pass
+
+    with self._lock:
+      grow = len(self._members) < self._size
+
+      if grow:
+        # Hold the place in the pool while the connection is opened.
+        self._members.append(None)
+
+    if not grow:
+      return self._idle.get()
+
+    try:
+      conn = self.Bind()
+    except:
+      with self._lock:
+        self._members.remove(None)
+      raise
+
+    with self._lock:
+      self._members[self._members.index(None)] = conn
+
+    return conn
+
+  def Prune(self):
+    """Unbinds the idle connections that no longer answer the server.
+
+    Returns:
+      The number of connections left in the pool.
+    """
+    live = []
+
+    while True:
+      try:
+        conn = self._idle.get_nowait()
+      except queue.Empty:
+        break
+
+      try:
+        conn.search_s('', ldap.SCOPE_BASE, '(objectClass=*)', ['1.1'])
+        live.append(conn)
+      except ldap.LDAPError:
+        with self._lock:
+          self._members.remove(conn)
+
+        try:
+          conn.unbind_s()
+        except ldap.LDAPError:
+          pass
+
+    for conn in reversed(live):
+      self._idle.put(conn)
+
+    with self._lock:
+      return len(self._members)
+
+  def Close(self):
+    """Unbinds every connection in the pool."""
+    with self._lock:
+      members = [conn for conn in self._members if conn is not None]
+      self._members = []
+      self._idle = queue.LifoQueue()
+
+    for conn in members:
+      conn.unbind_s()
 
 
 class Domain(object):
@@ -160,7 +505,19 @@ class Domain(object):
     self.dn_forest = ''
     self.dn_schema = ''
     self.dn_configuration = ''
-    self._ldap = None
+    self._cat_user = ''
+    self._cat_computer = ''
+    self._cat_group = ''
+    self._cat_cn = ''
+    self._cat_ou = ''
+    self._cat_domain = ''
+    self._user_cat_filter = ''
+    self._computer_cat_filter = ''
+    self._group_cat_filter = ''
+    self._container_cat_filter = ''
+    self._pool = None
+    self._pool_key = None
+    self._executor = None
 
   def __repr__(self):
     if self._connected:
@@ -168,7 +525,8 @@ class Domain(object):
     else:
       return 'Domain: Not Connected'
 
-  def Connect(self, ldap_host, user, password, cert_dir=None, cert_file=None):
+  def Connect(self, ldap_host, user, password, cert_dir=None, cert_file=None,
+              use_pool=False, pool_size=4):
     """Connect to the ldap server.
 
     Args:
@@ -177,6 +535,14 @@ class Domain(object):
       password: the password for authentication
       cert_dir: (Optional) The directory containing the SSL cert file
       cert_file: (Optional)The file name of the cert
+      use_pool: (Optional) Reuse the connections released by an earlier
+                Disconnect() for the same host and credentials, dropping any
+                that no longer answer, and release these for reuse when
+                Disconnect() is called
+      pool_size: (Optional) The most connections this Domain will open to
+                 serve operations running in parallel threads, and the number
+                 of worker threads used by the *Async methods.  Extra
+                 connections are only opened when needed.
 
     Raises:
       errors.LDAPConnectionFailedError: if no ldap connection can be made
@@ -188,48 +554,102 @@ class Domain(object):
     if cert_file:
       ldap.set_option(ldap.OPT_X_TLS_CACERTFILE, cert_file)
 
-    # NOTE: I intentionally wrote this to use ldaps instead of ldap.  Using
-    #       a non-SSL connection will send your domain password over the wire
-    #       in cleartext.
+    pool = None
+    pool_key = None
+
+    if use_pool:
+      pool_key = (ldap_host, user,
+                  hashlib.sha256(ToBytes(password)).hexdigest())
+      parked = _POOL.setdefault(pool_key, queue.LifoQueue())
+
+      try:
+        pool = parked.get_nowait()
+        pool.size = pool_size
+      except queue.Empty:
+        pass
+
+    if pool is None:
+      # NOTE: I intentionally wrote this to use ldaps instead of ldap.  Using
+      #       a non-SSL connection will send your domain password over the
+      #       wire in cleartext.
+      pool = LDAPConnectionPool('ldaps://%s' % ldap_host, user, password,
+                                size=pool_size)
+
     try:
-      self._ldap = ldap.initialize('ldaps://%s' % ldap_host)
-      self._ldap.protocol_version = 3
-      self._ldap.simple_bind_s(user, password)
+      # Parked connections may have been dropped by the server since, so only
+      # keep the ones that still answer.  Bind a first connection if none are
+      # left, so bad credentials are reported here.
+      if not pool.Prune():
+        pool.Add(pool.Bind())
+
+      self._pool = pool
       self._connected = True
-      self._ldap.set_option(ldap.OPT_REFERRALS, 0)
       self.GetRootDseAttrs()
     except ldap.SERVER_DOWN as e:
+      self._connected = False
+      pool.Close()
       raise errors.LDAPConnectionFailedError(e.args[0]['info'])
-    except ldap.INVALID_CREDENTIALS:
-      raise errors.InvalidCredentialsError
+
+    self._pool_key = pool_key
+
+    if self._executor is not None:
+      self._executor.shutdown(wait=False)
+
+    self._executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=pool_size)
 
   def Disconnect(self):
-    """Disconnects from ldap."""
-    self._ldap.unbind_s()
+    """Disconnects from ldap, or parks the connections for reuse."""
     self._connected = False
 
+    if self._executor is not None:
+      self._executor.shutdown(wait=False)
+      self._executor = None
+
+    if self._pool_key is not None:
+      _POOL[self._pool_key].put(self._pool)
+    else:
+      self._pool.Close()
+
+    self._pool = None
+
   def GetRootDseAttrs(self):
     """Gets the root DSE attributes."""
+    # The root DSE lives at the empty DN, so don't let Search() substitute the
+    # naming context from an earlier connection.
+    self.dn_root = ''
+    self.__dict__.pop('dns_name', None)
     root_dse = self.Search('objectClass=*', scope=ldap.SCOPE_BASE)[0]
     self.dn_root = ToStr(root_dse.properties['defaultNamingContext'][0])
     self.dn_forest = ToStr(root_dse.properties['defaultNamingContext'][0])
     self.dn_schema = ToStr(root_dse.properties['schemaNamingContext'][0])
     self.dn_configuration = ToStr(root_dse.properties['configurationNamingContext'][0])
 
-  @property
+    # The objectCategory values only depend on dn_configuration, so build them
+    # once here instead of on every Get*ByDN call.
+    self._cat_user = ToStr(constants.CAT_USER) + self.dn_configuration
+    self._cat_computer = ToStr(constants.CAT_COMPUTER) + self.dn_configuration
+    self._cat_group = ToStr(constants.CAT_GROUP) + self.dn_configuration
+    self._cat_cn = ToStr(constants.CAT_CN) + self.dn_configuration
+    self._cat_ou = ToStr(constants.CAT_OU) + self.dn_configuration
+    self._cat_domain = ToStr(constants.CAT_DOMAIN) + self.dn_configuration
+    self._user_cat_filter = '(objectCategory=%s)' % self._cat_user
+    self._computer_cat_filter = '(objectCategory=%s)' % self._cat_computer
+    self._group_cat_filter = '(objectCategory=%s)' % self._cat_group
+    self._container_cat_filter = ('(|(objectCategory=%s)(objectCategory=%s)'
+                                  '(objectCategory=%s))'
+                                  % (self._cat_cn, self._cat_domain,
+                                     self._cat_ou))
+
+  @functools.cached_property
   def dns_name(self):
     """Constructs the dns name of the domain from the distinguished name."""
-    dn_root = self.dn_root
-    elements = dn_root.split(',')
-    head = []
-
-    for element in elements:
-      if re.search('dc\=', element, re.IGNORECASE):
-        head.append(element.split('=')[1])
-    return '%s' % '.'.join(head)
+    return '.'.join(value for attr, value in _ParseDN(self.dn_root)
+                    if attr == 'dc')
 
   def Search(self, ldap_filter, base_dn=None, obj_class=None,
-             scope=ldap.SCOPE_SUBTREE, properties=None):
+             scope=ldap.SCOPE_SUBTREE, properties=None, sizelimit=0,
+             page_size=constants.PAGE_SIZE):
     """Searches ActiveDirectory for objects that match the ldap filter.
     Args:
       ldap_filter: an LDAP filter
@@ -237,6 +657,8 @@ class Domain(object):
       obj_class: can be any class that inherits from ADObject
       scope: one of the ldap SCOPE_ constants
       properties: a list of properties to retrieve
+      sizelimit: the maximum number of objects to return, or 0 for no limit
+      page_size: the number of objects the server returns per page
     Returns:
       A list of objects.
     Raises:
@@ -244,13 +666,47 @@ class Domain(object):
       errors.ADDomainNotConnectedError: if a search is attempted before calling
                                         Connect() on the Domain object
     """
+    return list(self.SearchIter(ldap_filter, base_dn=base_dn,
+                                obj_class=obj_class, scope=scope,
+                                properties=properties, sizelimit=sizelimit,
+                                page_size=page_size))
+
+  def SearchIter(self, ldap_filter, base_dn=None, obj_class=None,
+                 scope=ldap.SCOPE_SUBTREE, properties=None, sizelimit=0,
+                 page_size=constants.PAGE_SIZE):
+    """Searches ActiveDirectory, yielding objects as the results arrive.
+
+    This takes the same arguments as Search(), but only keeps one page of
+    results in memory at a time.  The search is sent when iteration starts, and
+    if the iterator is closed before it is exhausted, the outstanding page
+    request is abandoned.
+
+    An open iterator holds one of the pool's connections until it is exhausted
+    or closed, so close iterators that are abandoned part way through rather
+    than leaving them for other threads to wait on.
+
+    Multi-valued properties that AD returns in ranges, such as the member
+    property of a large group, are fetched in full.
+
+    Args:
+      ldap_filter: an LDAP filter
+      base_dn: the distinguished name of the container to start in
+      obj_class: can be any class that inherits from ADObject
+      scope: one of the ldap SCOPE_ constants
+      properties: a list of properties to retrieve
+      sizelimit: the maximum number of objects to return, or 0 for no limit
+      page_size: the number of objects the server returns per page
+    Returns:
+      An iterator of objects.
+    Raises:
+      errors.QueryTimeoutError: if the timeout period is exceeded
+      errors.ADDomainNotConnectedError: if a search is attempted before calling
+                                        Connect() on the Domain object
+    """
     if not self._connected:
       raise errors.ADDomainNotConnectedError
 
-    raw = []
-    results = []
     result_class = obj_class
-    page_size = 500
 
     if not base_dn:
       base_dn = self.dn_root
@@ -258,53 +714,162 @@ class Domain(object):
     if not result_class:
       result_class = ADObject
 
-    lc = ldap.controls.SimplePagedResultsControl(True, size=page_size, cookie='')
+    base_dn = ToStr(base_dn)
+    ldap_filter = ToStr(ldap_filter)
 
-    try:
-      msgid = self._ldap.search_ext(ToStr(base_dn), scope,
-                                    ToStr(ldap_filter),
+    return self._IterSearchResults(base_dn, scope, ldap_filter, properties,
+                                   sizelimit, page_size, result_class)
+
+  def _IterSearchResults(self, base_dn, scope, ldap_filter, properties,
+                         sizelimit, page_size, result_class):
+    """Runs a paged search for SearchIter() and yields the objects found."""
+    lc = ldap.controls.SimplePagedResultsControl(True, size=page_size, cookie='')
+    msgid = None
+
+    with self._pool.Acquire() as conn:
+      try:
+        try:
+          msgid = conn.search_ext(base_dn, scope, ldap_filter,
+                                  properties,
+                                  serverctrls=[lc],
+                                  sizelimit=sizelimit)
+        except ldap.TIMELIMIT_EXCEEDED:
+          raise errors.QueryTimeoutError
+
+        while msgid is not None:
+          rtype, rdata, rmsgid, serverctrls = conn.result3(msgid)
+          msgid = None
+
+          page_controls = [
+              c for c in serverctrls if c.controlType == ldap.controls.SimplePagedResultsControl.controlType]
+
+          # AD seems to not return page controls when the total size of the
+          # data is less than the page size, and returns an empty cookie on the
+          # last page.
+          if page_controls and page_controls[0].cookie:
+            # Ask for the next page before building objects from this one, so
+            # the server is working on it while we process the current results.
+            lc.cookie = page_controls[0].cookie
+            msgid = conn.search_ext(base_dn, scope, ldap_filter,
                                     properties,
-                                    serverctrls=[lc])
-    except ldap.TIMELIMIT_EXCEEDED:
-      raise errors.QueryTimeoutError
+                                    serverctrls=[lc],
+                                    sizelimit=sizelimit)
 
-    while True:
-      rtype, rdata, rmsgid, serverctrls = self._ldap.result3(msgid)
+          for result in rdata:
+            if result[0] is None:
+              continue
+
+            yield self._MakeObject(conn, result_class, result[0], result[1],
+                                   properties)
+      finally:
+        if msgid is not None:
+          conn.abandon(msgid)
 
-      for data in rdata:
-        raw.append(data)
+  def _MakeObject(self, conn, result_class, distinguished_name, attributes,
+                  properties):
+    """Builds an object from one search result entry.
 
-      page_controls = [
-          c for c in serverctrls if c.controlType == ldap.controls.SimplePagedResultsControl.controlType]
+    Args:
+      conn: the ldap connection the search ran on
+      result_class: the class of the object to build
+      distinguished_name: the distinguished name of the entry
+      attributes: the dict of attributes returned for the entry
+      properties: the list of properties the search asked for, or None for all
 
-      if page_controls:
-        cookie = page_controls[0].cookie
+    Returns:
+      An object of result_class.
+    """
+    # Every object carries the same few property names, so share one copy of
+    # each name between them.
+    props = {sys.intern(k): v for k, v in attributes.items()}
+    self._CompleteRanges(conn, distinguished_name, props, properties)
+
+    # AD leaves out attributes that have no value.  When every attribute was
+    # asked for, a missing mandatory property is known to be empty; otherwise
+    # only the default ones are marked, and the class reads any others itself.
+    if properties is None:
+      mandatory = result_class._MANDATORY_PROPS
+    else:
+      mandatory = constants.MANDATORY_PROPS_DEFAULT
 
-        if cookie:
-            lc.cookie = cookie
-            msgid = self._ldap.search_ext(ToStr(base_dn),
-                                          ldap.SCOPE_SUBTREE,
-                                          ToStr(ldap_filter),
-                                          serverctrls=[lc])
-        else:
-            break  # There is no more data to fetch
-      else:
-        break # AD seems to not return page controls when the total size of
-              # the data is less than the page size.
+    for prop in mandatory - props.keys():
+      props[prop] = ['']
+    props['distinguishedName'] = [distinguished_name]
+    return result_class(distinguished_name, properties=props, domain_obj=self)
 
-    for result in raw:
-      if result[0] is None:
+  def _CompleteRanges(self, conn, distinguished_name, props, properties):
+    """Fetches the rest of any properties AD returned in ranges.
+
+    AD returns at most 1500 values of a multi-valued property in one result,
+    under a name such as member;range=0-1499.  This asks for the following
+    ranges until the last one, ending in *, arrives and stores all the values
+    under the plain property name.
+
+    Only properties the search asked for by their plain name, or all
+    properties if it asked for none in particular, are completed.  A range
+    asked for explicitly is left as it is.
+
+    Args:
+      conn: the ldap connection the search is running on
+      distinguished_name: the distinguished name of the object
+      props: the dict of properties returned for the object, updated in place
+      properties: the list of properties the search asked for, or None for all
+    """
+    for key in [k for k in props if ';' in k]:
+      match = constants.RE_RANGE.match(key)
+
+      if not match:
         continue
 
-      for prop in constants.MANDATORY_PROPS_DEFAULT:
-        if prop not in result[1]:
-          result[1][prop] = ['']
-      result[1]['distinguishedName'] = [result[0]]
-      obj = result_class(result[0], properties=result[1], domain_obj=self)
-      results.append(obj)
+      prop, end = match.group(1), match.group(3)
+
+      if (properties is not None and
+          prop.lower() not in (name.lower() for name in properties)):
+        continue
+      values = props.pop(key)
+
+      while end != '*':
+        ranged = '%s;range=%d-*' % (prop, int(end) + 1)
+        result = conn.search_s(distinguished_name, ldap.SCOPE_BASE,
+                               'objectClass=*', [ranged])
+        end = '*'
+
+        for ranged_key, ranged_values in result[0][1].items():
+          match = constants.RE_RANGE.match(ranged_key)
+
+          if match and match.group(1).lower() == prop.lower():
+            values.extend(ranged_values)
+            end = match.group(3)
+
+      props[sys.intern(prop)] = values
 
-    return results
+  async def SearchAsync(self, ldap_filter, base_dn=None, obj_class=None,
+                        scope=ldap.SCOPE_SUBTREE, properties=None,
+                        sizelimit=0, page_size=constants.PAGE_SIZE):
+    """Runs Search() in a worker thread, for use from asyncio code.
 
+    Awaiting several of these together with asyncio.gather() runs the searches
+    concurrently, so the total time is close to that of the slowest search.
+    The arguments are the same as for Search().
+
+    Returns:
+      A list of objects.
+    Raises:
+      errors.ADDomainNotConnectedError: if a search is attempted before calling
+                                        Connect() on the Domain object
+    """
+    return await self._RunAsync(functools.partial(
+        self.Search, ldap_filter, base_dn=base_dn, obj_class=obj_class,
+        scope=scope, properties=properties, sizelimit=sizelimit,
+        page_size=page_size))
+
+  async def _RunAsync(self, func):
+    """Runs func in the Domain's worker threads and waits for the result."""
+    if self._executor is None:
+      raise errors.ADDomainNotConnectedError
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(self._executor, func)
 
   def NewObject(self, distinguished_name, properties):
     """Creates a new object in Active Directory.
@@ -333,7 +898,8 @@ class Domain(object):
       raise errors.ADDomainNotConnectedError
 
     modlist = ldap.modlist.addModlist(properties)
-    self._ldap.add_s(distinguished_name, modlist)
+    with self._pool.Acquire() as conn:
+      conn.add_s(distinguished_name, modlist)
 
   
   def NewUser(self, distinguished_name, properties):
@@ -371,7 +937,28 @@ class Domain(object):
       raise errors.ADDomainNotConnectedError
 
     mod = ldap.modlist.modifyModlist(current_props, updated_props)
-    result = self._ldap.modify_s(distinguished_name, mod)
+    return self.UpdateObjectModlist(distinguished_name, mod)
+
+  def UpdateObjectModlist(self, distinguished_name, modlist):
+    """Applies a prepared list of modifications to an object.
+
+    Args:
+      distinguished_name: the distinguished name of the object to be modified
+      modlist: a list of (operation, property, values) tuples, where operation
+               is one of the ldap.MOD_ constants
+
+    Returns:
+      True on success
+      False on failure
+
+    Raises:
+      errors.ADDomainNotConnectedError: if used before calling Connect()
+    """
+    if not self._connected:
+      raise errors.ADDomainNotConnectedError
+
+    with self._pool.Acquire() as conn:
+      result = conn.modify_s(distinguished_name, modlist)
 
     if result[0] == 103:
       return True
@@ -388,7 +975,8 @@ class Domain(object):
     if not self._connected:
       raise errors.ADDomainNotConnectedError
 
-    self._ldap.delete_s(distinguished_name)
+    with self._pool.Acquire() as conn:
+      conn.delete_s(distinguished_name)
 
   def GetObjectByName(self, name):
     """Get an ADObject from AD based on its sAMAccountName.
@@ -399,10 +987,8 @@ class Domain(object):
     Returns:
       An ADObject object on success, nothing if no user found.
     """
-    result = self.Search('sAMAccountName=%s' % Escape(name))
-
-    if result:
-      return result[0]
+    return next(self.SearchIter('sAMAccountName=%s' % Escape(name),
+                                sizelimit=1), None)
 
   def GetUserByName(self, user_name):
     """Get a user object from AD based on its sAMAccountName.
@@ -413,11 +999,8 @@ class Domain(object):
     Returns:
       A user object on success, nothing if no user found.
     """
-    result = self.Search('sAMAccountName=%s'
-                         % Escape(user_name), obj_class=User)
-
-    if result:
-      return result[0]
+    return next(self.SearchIter('sAMAccountName=%s' % Escape(user_name),
+                                obj_class=User, sizelimit=1), None)
 
   def GetComputerByName(self, computer_name):
     """Get a Computer object from AD based on its hostname.
@@ -428,16 +1011,16 @@ class Domain(object):
     Returns:
       A Computer object on success, nothing if no computer found.
     """
-    account = constants.RE_HOSTNAME.match(computer_name).group()
+    if '.' in computer_name:
+      account = constants.RE_HOSTNAME.match(computer_name).group()
+    else:
+      account = computer_name
 
-    if account[-1] != '$':
+    if not account.endswith('$'):
       account += '$'
 
-    result = self.Search('sAMAccountName=%s'
-                         % Escape(account), obj_class=Computer)
-
-    if result:
-      return result[0]
+    return next(self.SearchIter('sAMAccountName=%s' % Escape(account),
+                                obj_class=Computer, sizelimit=1), None)
 
   def GetGroupByName(self, group_name):
     """Get a Group object from AD based on its hostname.
@@ -447,11 +1030,69 @@ class Domain(object):
     Returns:
       A Group object on success, nothing if no computer found.
     """
-    result = self.Search('sAMAccountName=%s'
-                         % Escape(group_name), obj_class=Group)
+    return next(self.SearchIter('sAMAccountName=%s' % Escape(group_name),
+                                obj_class=Group, sizelimit=1), None)
 
-    if result:
-      return result[0]
+  def GetObjectsByNames(self, names, obj_class=None, properties=None):
+    """Get several objects from AD by sAMAccountName in batched searches.
+
+    The objects are retrieved with one search per constants.FILTER_BATCH_SIZE
+    names, rather than one search each.
+
+    Args:
+      names: a list of Windows account names (sAMAccountName)
+      obj_class: (Optional) the ADObject subclass to return
+      properties: (Optional) a list of properties to retrieve, rather than all
+                  of them.  sAMAccountName is always retrieved.
+
+    Returns:
+      A dict of the objects found, keyed on the names requested.  Names that
+      were not found are left out.
+    """
+    if not names:
+      return {}
+
+    # AD matches names case-insensitively, so do the same when pairing the
+    # results up with the names that were asked for.
+    unique = list(dict((ToStr(name).lower(), name) for name in names).values())
+    results = {}
+
+    # The results are paired up with the names on sAMAccountName.
+    if properties is not None and 'sAMAccountName' not in properties:
+      properties = list(properties) + ['sAMAccountName']
+
+    for obj in self._SearchBatches('sAMAccountName', unique, obj_class,
+                                   properties):
+      results[ToStr(obj.properties['sAMAccountName'][0]).lower()] = obj
+
+    return dict((name, results[ToStr(name).lower()]) for name in names
+                if ToStr(name).lower() in results)
+
+  def GetUsersByNames(self, user_names, obj_class=None):
+    """Get several User objects from AD by sAMAccountName in batched searches.
+
+    Args:
+      user_names: a list of Windows usernames (sAMAccountName)
+      obj_class: (Optional) the ADObject subclass to return, User by default
+
+    Returns:
+      A dict of the objects found, keyed on the names requested.  Names that
+      were not found are left out.
+    """
+    return self.GetObjectsByNames(user_names, obj_class=obj_class or User)
+
+  async def GetUsersByNamesAsync(self, user_names, obj_class=None):
+    """Runs GetUsersByNames() in a worker thread, for use from asyncio code.
+
+    Args:
+      user_names: a list of Windows usernames (sAMAccountName)
+      obj_class: (Optional) the ADObject subclass to return, User by default
+
+    Returns:
+      A dict of the objects found, keyed on the names requested.
+    """
+    return await self._RunAsync(functools.partial(
+        self.GetUsersByNames, user_names, obj_class=obj_class))
 
   def GetObjectByDN(self, distinguished_name):
     """Gets an ADObject object based on the distinguished name(DN).
@@ -462,11 +1103,124 @@ class Domain(object):
     Returns:
       An ADObject object on success, nothing if no user found.
     """
-    ldap_filter = '(distinguishedName=%s)' % Escape(distinguished_name)
-    result = self.Search(ldap_filter, obj_class=User)
+    return self._GetObjectAtDN(distinguished_name, 'objectClass=*', ADObject)
 
-    if result:
-      return result[0]
+  def GetObjectsByDNs(self, distinguished_names, obj_class=None,
+                      properties=None):
+    """Gets several objects based on their distinguished names(DN).
+
+    The objects are retrieved with one search per constants.FILTER_BATCH_SIZE
+    DNs, rather than one search each.
+
+    Args:
+      distinguished_names:  A list of distinguished names
+      obj_class: (Optional) the ADObject subclass to return
+      properties: (Optional) a list of properties to retrieve, rather than all
+                  of them
+
+    Returns:
+      A dict of the objects found, keyed on the distinguished names requested.
+      DNs that were not found are left out.
+    """
+    if not distinguished_names:
+      return {}
+
+    # DNs are case-insensitive, so do the same when pairing the results up
+    # with the DNs that were asked for.
+    unique = list(dict((_DNKey(dn), dn)
+                       for dn in distinguished_names).values())
+    results = {}
+
+    for obj in self._SearchBatches('distinguishedName', unique, obj_class,
+                                   properties):
+      results[_DNKey(obj.distinguished_name)] = obj
+
+    return dict((dn, results[_DNKey(dn)]) for dn in distinguished_names
+                if _DNKey(dn) in results)
+
+  def _SearchBatches(self, attribute, values, obj_class, properties=None):
+    """Finds the objects with any of the values, in batched searches.
+
+    One search is made per constants.FILTER_BATCH_SIZE values.  When there is
+    more than one batch, they are searched in parallel threads, each on its own
+    connection from the pool.
+
+    Args:
+      attribute: the name of the attribute to match
+      values: a list of the values to match
+      obj_class: (Optional) the ADObject subclass to return
+      properties: (Optional) a list of properties to retrieve
+
+    Returns:
+      A list of the objects found.
+    """
+    filters = [_OrFilter(attribute, chunk)
+               for chunk in _Chunks(values, constants.FILTER_BATCH_SIZE)]
+
+    # A thread pool only pays for itself with several searches to run.
+    if len(filters) < 2:
+      return [obj for ldap_filter in filters
+              for obj in self.SearchIter(ldap_filter, obj_class=obj_class,
+                                         properties=properties)]
+
+    # The caller may be holding the only connection, so a pool of one can't
+    # lend out more.  Send all the searches down it at once instead.
+    if self._pool.size < 2:
+      return self._SearchPipelined(filters, obj_class, properties)
+
+    workers = min(len(filters), self._pool.size)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+      futures = [ex.submit(self.Search, ldap_filter, obj_class=obj_class,
+                           properties=properties)
+                 for ldap_filter in filters]
+      return [obj for future in futures for obj in future.result()]
+
+  def _SearchPipelined(self, filters, obj_class, properties):
+    """Runs several searches at once on a single connection.
+
+    Every search is sent before any results are read, so the server works on
+    them while earlier results are still being collected.  The searches are not
+    paged, so each must match fewer objects than the server's page size limit,
+    as the constants.FILTER_BATCH_SIZE batches do.
+
+    Args:
+      filters: a list of ldap filters
+      obj_class: (Optional) the ADObject subclass to return
+      properties: (Optional) a list of properties to retrieve
+
+    Returns:
+      A list of the objects found.
+    """
+    if not self._connected:
+      raise errors.ADDomainNotConnectedError
+
+    result_class = obj_class or ADObject
+    output = []
+
+    with self._pool.Acquire() as conn:
+      msgids = []
+
+      try:
+        for ldap_filter in filters:
+          msgids.append(conn.search_ext(self.dn_root, ldap.SCOPE_SUBTREE,
+                                        ldap_filter, properties))
+
+        while msgids:
+          rdata = conn.result3(msgids[0])[1]
+          msgids.pop(0)
+
+          for result in rdata:
+            if result[0] is not None:
+              output.append(self._MakeObject(conn, result_class, result[0],
+                                             result[1], properties))
+      except ldap.TIMELIMIT_EXCEEDED:
+        raise errors.QueryTimeoutError
+      finally:
+        for msgid in msgids:
+          conn.abandon(msgid)
+
+    return output
 
   def GetUserByDN(self, distinguished_name):
     """Gets a User object based on the distinguished name(DN).
@@ -477,14 +1231,7 @@ class Domain(object):
     Returns:
       A User object on success, nothing if no user found.
     """
-    ldap_filter = ('(&(distinguishedName=%s)(objectCategory=%s%s))'
-                   % (Escape(distinguished_name),
-                      constants.CAT_USER,
-                      self.dn_configuration))
-    result = self.Search(ldap_filter, obj_class=User)
-
-    if result:
-      return result[0]
+    return self._GetObjectAtDN(distinguished_name, self._user_cat_filter, User)
 
   def GetComputerByDN(self, distinguished_name):
     """Gets a Computer object based on the distinguished name(DN).
@@ -495,14 +1242,8 @@ class Domain(object):
     Returns:
       A Computer object on success, nothing if no user found.
     """
-    ldap_filter = ('(&(distinguishedName=%s)(objectCategory=%s%s))'
-                   % (Escape(distinguished_name),
-                      constants.CAT_COMPUTER,
-                      self.dn_configuration))
-    result = self.Search(ldap_filter, obj_class=Computer)
-
-    if result:
-      return result[0]
+    return self._GetObjectAtDN(distinguished_name, self._computer_cat_filter,
+                               Computer)
 
   def GetGroupByDN(self, distinguished_name):
     """Gets a Group object based on the distinguished name(DN).
@@ -513,14 +1254,7 @@ class Domain(object):
     Returns:
       A User object on success, nothing if no user found.
     """
-    ldap_filter = ('(&(distinguishedName=%s)(objectCategory=%s%s))'
-                   % (Escape(distinguished_name),
-                      constants.CAT_GROUP,
-                      self.dn_configuration))
-    result = self.Search(ldap_filter, obj_class=Group)
-
-    if result:
-      return result[0]
+    return self._GetObjectAtDN(distinguished_name, self._group_cat_filter, Group)
 
   def GetContainerByDN(self, distinguished_name):
     """Gets a Group object based on the distinguished name(DN).
@@ -531,18 +1265,72 @@ class Domain(object):
     Returns:
       A User object on success, nothing if no user found.
     """
-    ldap_filter = ''.join(['(&(distinguishedName=%s)'
-                           % Escape(distinguished_name),
-                           '(|(objectCategory=%s%s)'
-                           % (constants.CAT_CN, self.dn_configuration),
-                           '(objectCategory=%s%s)'
-                           % (constants.CAT_DOMAIN, self.dn_configuration),
-                           '(objectCategory=%s%s)))'
-                           % (constants.CAT_OU, self.dn_configuration)])
-    result = self.Search(ldap_filter, obj_class=Container)
+    return self._GetObjectAtDN(distinguished_name, self._container_cat_filter,
+                               Container)
 
-    if result:
-      return result[0]
+  def _GetObjectAtDN(self, distinguished_name, ldap_filter, obj_class,
+                     properties=None):
+    """Reads a single object with a base scoped search on its DN.
+
+    Args:
+      distinguished_name: the distinguished name of the object
+      ldap_filter: an LDAP filter the object must also match
+      obj_class: the class of the object to return
+      properties: (Optional) a list of properties to retrieve
+
+    Returns:
+      The object on success, nothing if no matching object was found or the
+      DN is malformed.
+    """
+    try:
+      return next(self.SearchIter(ldap_filter, base_dn=distinguished_name,
+                                  obj_class=obj_class, scope=ldap.SCOPE_BASE,
+                                  properties=properties), None)
+    except (ldap.NO_SUCH_OBJECT, ldap.INVALID_DN_SYNTAX):
+      return None
+
+  def _GuessObjectClass(self, obj):
+    """Returns the ad_ldap class that best represents the object.
+
+    Args:
+      obj: an ADObject object with its objectCategory property populated
+
+    Returns:
+      One of Computer, User, Group or Container, or ADObject if the object
+      category is not recognised.
+    """
+    # The category is the DN of a schema class, e.g. CN=Person,CN=Schema,...
+    parts = _ParseDN(ToStr(obj.object_category))
+
+    if not parts:
+      return ADObject
+
+    return _CATEGORY_CLASSES.get(parts[0][1], ADObject)
+
+  def _TypedObject(self, obj):
+    """Rebuilds an object as the ad_ldap class that best represents it.
+
+    Unlike GuessObjectType, this makes no further searches, so the object
+    should have been read with all of its attributes, or at least with its
+    objectCategory.  Mandatory properties that were not read are left empty.
+
+    Args:
+      obj: an ADObject object with its objectCategory property populated
+
+    Returns:
+      An object of the class picked by _GuessObjectClass.
+    """
+    obj_class = self._GuessObjectClass(obj)
+
+    if obj_class is ADObject:
+      return obj
+
+    # AD leaves out attributes that have no value, so mark them as empty
+    # rather than letting the constructor search for them again.
+    for prop in obj_class._MANDATORY_PROPS - obj.properties.keys():
+      obj.properties[prop] = ['']
+
+    return obj_class(obj.distinguished_name, obj.properties, self)
 
   def GuessObjectType(self, obj):
     """Try to find the best ad_ldap object class for the object.
@@ -561,16 +1349,16 @@ class Domain(object):
     if not isinstance(obj, ADObject):
       raise errors.ADObjectClassOnlyError
 
-    if 'CN=Computer' in obj.object_category:
+    obj_class = self._GuessObjectClass(obj)
+
+    if obj_class is Computer:
       return self.GetComputerByDN(obj.distinguished_name)
-    elif 'CN=Person' in obj.object_category:
+    elif obj_class is User:
       return self.GetUserByDN(obj.distinguished_name)
-    elif 'CN=Group' in obj.object_category:
+    elif obj_class is Group:
       return self.GetGroupByDN(obj.distinguished_name)
-    elif 'CN=Container' in obj.object_category:
-      return self.GetContainterByDN(obj.distinguished_name)
-    elif 'CN=Organizational-Unit' in obj.object_category:
-      return self.GetContainterByDN(obj.distinguished_name)
+    elif obj_class is Container:
+      return self.GetContainerByDN(obj.distinguished_name)
     else:
       return obj
 
@@ -578,6 +1366,13 @@ class Domain(object):
 class ADObject(object):
   """A generic AD Object."""
 
+  # Names of functools.cached_property attributes derived from self.properties,
+  # which must be dropped whenever the properties are reloaded or written.
+  _CACHED_PROPERTIES = ('distinguished_name', 'canonical_name', '_rdn_value')
+
+  # The properties that must always be retrieved for this class.
+  _MANDATORY_PROPS = constants.MANDATORY_PROPS_DEFAULT
+
   def __init__(self, distinguished_name, properties, domain_obj):
     """Initialize the AD object.
 
@@ -589,37 +1384,39 @@ class ADObject(object):
                   by an ldap query
       domain_obj: the Domain object that the AD object is associated with
     """
-    get_props = []
     self.properties = {}
     self.properties['distinguishedName'] = [distinguished_name]
     self._property_snapshot = {}
 
     if isinstance(properties, dict):
       self.properties = properties
-      for prop in constants.MANDATORY_PROPS_DEFAULT:
-        if prop not in properties:
-          get_props.append(prop)
-    elif isinstance(properties, list):
-      for prop in constants.MANDATORY_PROPS_DEFAULT:
-        if prop not in properties:
-          properties.append(prop)
 
-      get_props = properties
+    get_props = _MissingProps(properties, self._MANDATORY_PROPS)
 
     self._domain_obj = domain_obj
 
     if get_props:
       self.GetProperties(get_props)
 
-    self._property_snapshot = copy.deepcopy(self.properties)
+    self._property_snapshot = _Snapshot(self.properties)
 
   def __repr__(self):
     return 'ADObject: %s' % self.distinguished_name
 
-  @property
+  def _ClearCachedProperties(self):
+    """Forgets any values cached from self.properties."""
+    for name in self._CACHED_PROPERTIES:
+      self.__dict__.pop(name, None)
+
+  @functools.cached_property
   def distinguished_name(self):
     return self.properties['distinguishedName'][0]
 
+  @functools.cached_property
+  def _rdn_value(self):
+    """The value of the first RDN, e.g. the CN of a user, for __repr__."""
+    return _ParseDN(ToStr(self.distinguished_name))[0][1]
+
   @property
   def object_class(self):
     return self.properties['objectClass']
@@ -633,29 +1430,21 @@ class ADObject(object):
     if not self.properties['whenCreated'][0]:
       return 0
     else:
-      return TextTimeToUnix(self.properties['whenCreated'][0])
+      return ADTextTimeToUnix(ToStr(self.properties['whenCreated'][0]))
 
   @property
   def modified_time(self):
     if not self.properties['whenChanged'][0]:
       return 0
     else:
-      return TextTimeToUnix(self.properties['whenChanged'][0])
+      return ADTextTimeToUnix(ToStr(self.properties['whenChanged'][0]))
 
-  @property
+  @functools.cached_property
   def canonical_name(self):
     """Constructs the canonical name from the distinguished name."""
-    elements = ToStr(self.distinguished_name).split(',')
-    head = []
-    tail = []
-
-    for element in elements:
-      if re.search('dc\=', element, re.IGNORECASE):
-        head.append(element.split('=')[1])
-      else:
-        tail.append(element.split('=')[1])
-
-    tail.reverse()
+    parts = _ParseDN(ToStr(self.distinguished_name))
+    head = [value for attr, value in parts if attr == 'dc']
+    tail = [value for attr, value in reversed(parts) if attr != 'dc']
     return '%s\\%s' % ('.'.join(head), '\\'.join(tail))
 
   def GetProperties(self, properties):
@@ -667,20 +1456,35 @@ class ADObject(object):
     Raises:
       errors.NonListParameterError: if a string is passed instead of a list
     """
-    if properties.__class__.__name__ in ('str', 'unicode'):
+    if isinstance(properties, (str, bytes)):
       raise errors.NonListParameterError
 
-    ldap_filter = 'distinguishedName=%s' % Escape(self.distinguished_name)
-    result = self._domain_obj.Search(ldap_filter,
-                                     properties=properties)
+    result = self._domain_obj._GetObjectAtDN(self.distinguished_name,
+                                             'objectClass=*', ADObject,
+                                             properties=properties)
     if result:
-      for prop in result[0].properties:
-        self.properties[prop] = result[0].properties[prop]
-        self._property_snapshot[prop] = result[0].properties[prop]
+      # Only take the properties that were asked for, since the result also
+      # holds placeholders for mandatory properties that weren't fetched.  AD
+      # leaves out attributes with no value, so mark those as empty.
+      returned = dict((name.lower(), name) for name in result.properties)
+      fetched = {}
+
+      for name in properties:
+        key = returned.get(name.lower())
+
+        if key:
+          fetched[key] = result.properties[key]
+        else:
+          fetched[name] = ['']
+
+      self.properties.update(fetched)
+      self._property_snapshot.update(_Snapshot(fetched))
+
+      self._ClearCachedProperties()
 
   def Refresh(self):
     """Update all properties with values from AD."""
-    self.GetProperties([x for x in self.properties])
+    self.GetProperties(list(self.properties))
 
   def Move(self, destination):
     """Move an AD object from one part of the directory to another.
@@ -688,14 +1492,11 @@ class ADObject(object):
     Args:
       destination: the destination DN
     """
-    prefix = None
-
-    try:
-      prefix = 'CN=%s' % constants.RE_CN.findall(self.distinguished_name)[0]
-    except IndexError:
-      prefix = 'OU=%s' % constants.RE_OU.findall(self.distinguished_name)[0]
+    attr, value = _ParseDN(ToStr(self.distinguished_name))[0]
+    prefix = '%s=%s' % (attr.upper(), value)
 
-    self.properties['distinguishedName'] = '%s,%s' % (prefix, destination)
+    self.properties['distinguishedName'] = ['%s,%s' % (prefix, destination)]
+    self._ClearCachedProperties()
     self.SetProperties()
 
   def Delete(self):
@@ -703,6 +1504,7 @@ class ADObject(object):
     self._domain_obj.DeleteObject(self.distinguished_name)
     self.properties = {}
     self._property_snapshot = {}
+    self._ClearCachedProperties()
 
   def SetProperties(self):
     """Write changed properties to Active Directory.
@@ -713,22 +1515,24 @@ class ADObject(object):
       True: on success
       False: on failure
     """
-    old = {}
-    new = {}
+    snapshot = self._property_snapshot
+    properties = self.properties
 
-    for prop in self._property_snapshot:
-      if self._property_snapshot[prop] != self.properties[prop]:
-        new[prop] = self.properties[prop]
-        old[prop] = self._property_snapshot[prop]
+    new = {k: v for k, v in properties.items() if snapshot.get(k) != v}
 
-    for prop in self.properties:
-      if prop not in self._property_snapshot:
-        self._property_snapshot[prop] = [None]
+    self._ClearCachedProperties()
+    modlist = _BuildModlist(new)
 
-    result = self._domain_obj.UpdateObject(self.distinguished_name, old, new)
+    # Nothing in AD needs to change, so skip the round trip.
+    if not modlist:
+      self._property_snapshot = _Snapshot(self.properties)
+      return True
+
+    result = self._domain_obj.UpdateObjectModlist(self.distinguished_name,
+                                                  modlist)
 
     if result:
-      self._property_snapshot = copy.deepcopy(self.properties)
+      self._property_snapshot = _Snapshot(self.properties)
       return True
     else:
       return False
@@ -741,32 +1545,13 @@ class User(ADObject):
   unlocking, disabling and enabling accounts.
   """
 
-  def __init__(self, distinguished_name, properties, domain_obj):
-    ADObject.__init__(self, distinguished_name, properties, domain_obj)
-    get_props = []
-
-    if isinstance(properties, dict):
-      self.properties = properties
-
-      for prop in constants.MANDATORY_PROPS_USER:
-        if prop not in properties:
-          get_props.append(prop)
-    elif isinstance(properties, list):
-      for prop in constants.MANDATORY_PROPS_USER:
-        if prop not in properties:
-          properties.append(prop)
-
-      get_props = properties
-
-    if get_props:
-      self.GetProperties(get_props)
-
-    self._property_snapshot = copy.deepcopy(self.properties)
+  _CACHED_PROPERTIES = ADObject._CACHED_PROPERTIES + ('user_account_control',)
+  _MANDATORY_PROPS = constants.MANDATORY_PROPS_USER
 
   def __repr__(self):
-    return 'User: %s' % constants.RE_CN.findall(self.distinguished_name)[0]
+    return 'User: %s' % self._rdn_value
 
-  @property
+  @functools.cached_property
   def user_account_control(self):
     return int(self.properties['userAccountControl'][0])
 
@@ -837,8 +1622,7 @@ class User(ADObject):
     if self.disabled:
       raise errors.UserNotEnabledError
 
-    uac = int(self.properties['userAccountControl'][0])
-    value = uac | constants.ADS_UF_ACCOUNTDISABLE
+    value = self.user_account_control | constants.ADS_UF_ACCOUNTDISABLE
     self.properties['userAccountControl'] = [str(value)]
     self.SetProperties()
 
@@ -860,9 +1644,8 @@ class User(ADObject):
     if not self.disabled:
       raise errors.UserNotDisabledError
 
-    uac = int(self.properties['userAccountControl'][0])
-    value = uac ^ constants.ADS_UF_ACCOUNTDISABLE
-    self.properties['userAccountControl'] = [ToStr(value)]
+    value = self.user_account_control ^ constants.ADS_UF_ACCOUNTDISABLE
+    self.properties['userAccountControl'] = [str(value)]
     self.SetProperties()
 
     if not self.disabled:
@@ -879,30 +1662,10 @@ class Computer(User):
   User class.
   """
 
-  def __init__(self, distinguished_name, properties, domain_obj):
-    User.__init__(self, distinguished_name, properties, domain_obj)
-    get_props = []
-
-    if isinstance(properties, dict):
-      self.properties = properties
-
-      for prop in constants.MANDATORY_PROPS_COMPUTER:
-        if prop not in properties:
-          get_props.append(prop)
-    elif isinstance(properties, list):
-      for prop in constants.MANDATORY_PROPS_COMPUTER:
-        if prop not in properties:
-          properties.append(prop)
-
-      get_props = properties
-
-    if get_props:
-      self.GetProperties(get_props)
-
-    self._property_snapshot = copy.deepcopy(self.properties)
+  _MANDATORY_PROPS = constants.MANDATORY_PROPS_COMPUTER
 
   def __repr__(self):
-    return 'Computer: %s' % constants.RE_CN.findall(self.distinguished_name)[0]
+    return 'Computer: %s' % self._rdn_value
 
   @property
   def service_principal_name(self):
@@ -933,12 +1696,7 @@ class Container(ADObject):
   """
 
   def __repr__(self):
-    try:
-      return ('Container: %s'
-              % constants.RE_OU.findall(self.distinguished_name)[0])
-    except IndexError:
-      return ('Container: %s'
-              % constants.RE_CN.findall(self.distinguished_name)[0])
+    return 'Container: %s' % self._rdn_value
 
   def GetChildren(self, recursive=False):
     """Retrieves a list of objects inside the container."""
@@ -950,12 +1708,14 @@ class Container(ADObject):
     else:
       scope = ldap.SCOPE_ONELEVEL
 
-    results = self._domain_obj.Search('objectClass=*',
-                                      base_dn=self.distinguished_name,
-                                      properties=['distinguishedName'],
-                                      scope=scope)
+    # Fetch every attribute, so the children can be built straight from the
+    # search results and match what the Get*ByDN methods return.
+    results = self._domain_obj.SearchIter('objectClass=*',
+                                          base_dn=self.distinguished_name,
+                                          scope=scope)
+
     for obj in results:
-      output.append(self._domain_obj.GuessObjectType(obj))
+      output.append(self._domain_obj._TypedObject(obj))
 
     return output
 
@@ -966,51 +1726,55 @@ class Group(ADObject):
   This class provides extra methods for manipulating group memberships.
   """
 
-  def __init__(self, distinguished_name, properties, domain_obj):
-    ADObject.__init__(self, distinguished_name, properties, domain_obj)
-    get_props = []
+  _MANDATORY_PROPS = constants.MANDATORY_PROPS_GROUP
 
-    if isinstance(properties, dict):
-      self.properties = properties
-
-      for prop in constants.MANDATORY_PROPS_GROUP:
-        if prop not in properties:
-          get_props.append(prop)
-    elif isinstance(properties, list):
-      for prop in constants.MANDATORY_PROPS_GROUP:
-        if prop not in properties:
-          properties.append(prop)
-
-      get_props = properties
-
-    if get_props:
-      self.GetProperties(get_props)
-
-    self._property_snapshot = copy.deepcopy(self.properties)
+  def __init__(self, distinguished_name, properties, domain_obj):
+    super().__init__(distinguished_name, properties, domain_obj)
+
+    # Keep member as a list of bytes DNs, the way ldap returns them, so the
+    # member methods never mix str and bytes or carry an empty placeholder.
+    # member is mandatory, so by now it has been read, and an empty group is
+    # left with the placeholder.
+    members = [ToBytes(member) for member in self.properties.get('member', [])
+               if member]
+    self.properties['member'] = members
+    self._property_snapshot['member'] = list(members)
 
   def __repr__(self):
-    return 'Group: %s' % constants.RE_CN.findall(self.distinguished_name)[0]
+    return 'Group: %s' % self._rdn_value
 
-  def GetMembers(self):
+  def GetMembers(self, properties=None):
     """Retrieves a list of objects that are members.
 
     GetMembers will try to find the appropriate object type for the member if
-    if is a user, computer or group.
+    if is a user, computer or group.  The members are read in batched searches
+    of constants.FILTER_BATCH_SIZE, with no further search per member.
+
+    Args:
+      properties: (Optional) a list of properties to retrieve for each member,
+                  rather than all of them.  objectCategory is always retrieved
+                  so the member can be typed.  Mandatory properties that are
+                  not asked for are left empty, so leave out member to avoid
+                  reading the members of nested groups.
 
     Returns:
       A list of objects.
     """
-    members = []
     output = []
+    members = [member for member in self.properties.get('member', [])
+               if member]
 
-    for member in self.properties['member']:
-      result = self._domain_obj.Search('distinguishedName=%s' % Escape(member))
+    if properties is not None and 'objectCategory' not in properties:
+      properties = list(properties) + ['objectCategory']
 
-      if result:
-        members.append(result[0])
+    # Read every attribute asked for in the batch search, so each member can be
+    # built from its result without being read again.
+    found = self._domain_obj.GetObjectsByDNs(members, properties=properties)
 
-    for obj in members:
-      output.append(self._domain_obj.GuessObjectType(obj))
+    # Keep the objects in the same order as the member property.
+    for member in members:
+      if member in found:
+        output.append(self._domain_obj._TypedObject(found[member]))
 
     return output
 
@@ -1025,25 +1789,26 @@ class Group(ADObject):
       False on failure
 
     Raises:
-      errors.ADGroupMemberExistsError: if the member was already in the group
+      errors.MemberAlreadyError: if the member was already in the group
       errors.NonListParameterError: if a string was passed by mistake
     """
-    if member_list.__class__.__name__ in ('str', 'unicode'):
+    if isinstance(member_list, (str, bytes)):
       raise errors.NonListParameterError
 
-    members_to_add = []
-
-    for name in member_list:
-      result = self._domain_obj.GetObjectByName(name)
+    existing = set(_DNKey(member) for member in self.properties['member'])
+    found = self._domain_obj.GetObjectsByNames(
+        member_list, properties=['sAMAccountName'])
 
-      if result:
-        members_to_add.append(ToBytes(result.distinguished_name))
+    # The same object may be named more than once, in any case, so only
+    # check each DN against the group once.
+    resolved = dict((_DNKey(found[name].distinguished_name),
+                     ToBytes(found[name].distinguished_name))
+                    for name in member_list if name in found)
 
-    for member in members_to_add:
-      if member in self.properties['member']:
-        raise errors.ADGroupMemberExistsError
+    if existing.intersection(resolved):
+      raise errors.MemberAlreadyError
 
-    self.properties['member'] += members_to_add
+    self.properties['member'] += resolved.values()
     return self.SetProperties()
 
   def DeleteMembers(self, member_list):
@@ -1058,32 +1823,22 @@ class Group(ADObject):
 
     Raises:
       errors.NonListParameterError: if a string was passed by mistake
-      errors.ADGroupMemberDoesNotExistError: if the object to be removed is not
-                                             a member
+      errors.NotAMemberError: if the object to be removed is not a member
     """
-    if member_list.__class__.__name__ in ('str', 'unicode'):
+    if isinstance(member_list, (str, bytes)):
       raise errors.NonListParameterError
 
-    members_to_remove = []
-
-    for name in member_list:
-      result = self._domain_obj.GetObjectByName(name)
-
-      if result:
-        if result.distinguished_name not in self.properties['member']:
-          self.GetProperties(['member'])
-          raise errors.ADGroupMemberDoesNotExistError
+    current = set(_DNKey(member) for member in self.properties['member'])
+    found = self._domain_obj.GetObjectsByNames(
+        member_list, properties=['sAMAccountName'])
+    members_to_remove = set(_DNKey(obj.distinguished_name)
+                            for obj in found.values())
 
-        members_to_remove.append(result.distinguished_name)
+    if members_to_remove - current:
+      raise errors.NotAMemberError
 
-    members_to_remove = set(members_to_remove)
-    current = set(self.properties['member'])
-    new_list = list(current - members_to_remove)
-
-    if not new_list:
-      new_list = []
-
-    self.properties['member'] = new_list
+    self.properties['member'] = [member for member in self.properties['member']
+                                 if _DNKey(member) not in members_to_remove]
     return self.SetProperties()
 
   def OverwriteMembers(self, member_list):
@@ -1099,25 +1854,40 @@ class Group(ADObject):
     Raises:
       errors.NonListParameterError: if a string was passed by mistake
     """
-    if member_list.__class__.__name__ in ('str', 'unicode'):
+    if isinstance(member_list, (str, bytes)):
       raise errors.NonListParameterError
 
     members = []
+    found = self._domain_obj.GetObjectsByNames(
+        member_list, properties=['sAMAccountName'])
 
     for name in member_list:
-      result = self._domain_obj.GetObjectByName(name)
-
-      if result:
-        members.append(result.distinguished_name)
+      if name in found:
+        members.append(ToBytes(found[name].distinguished_name))
       else:
         raise errors.ADObjectNotFoundError
 
-    old_members = set(self.properties['member'])
-    new_members = set(members)
+    # Drop duplicates, keeping the order the names were given in.
+    members = list(dict((_DNKey(member), member)
+                        for member in members).values())
+    old_members = self.properties['member']
 
-    # If the members are the same, it's a no-op.
-    if old_members == new_members:
+    # If the members are the same, it's a no-op.  Lists of different lengths
+    # can't hold the same members, so only build the sets when they match.
+    if (len(members) == len(old_members) and
+        set(_DNKey(member) for member in members) ==
+        set(_DNKey(member) for member in old_members)):
       return True
 
     self.properties['member'] = members
     return self.SetProperties()
+
+
+# The ad_ldap class for each objectCategory, keyed on the schema class name.
+_CATEGORY_CLASSES = {
+    'Computer': Computer,
+    'Person': User,
+    'Group': Group,
+    'Container': Container,
+    'Organizational-Unit': Container,
+}
@@ -17,23 +17,42 @@ limitations under the License.
 """
 
 import re
+import sys
 
-# Properties that must be included by default for any ADObject
-MANDATORY_PROPS_DEFAULT = ('distinguishedName', 'objectClass', 'objectCategory',
-                           'name', 'description', 'createTimeStamp',
-                           'modifyTimeStamp')
+# Properties that must be included by default for any ADObject.  These are
+# frozensets so that the missing properties of an object can be found with a
+# single set difference, and the names are interned to match the interned
+# property names in search results.
+MANDATORY_PROPS_DEFAULT = frozenset(sys.intern(prop) for prop in (
+    'distinguishedName', 'objectClass', 'objectCategory', 'name',
+    'description', 'createTimeStamp', 'modifyTimeStamp'))
 
 # Default properties for User objects
-MANDATORY_PROPS_USER = MANDATORY_PROPS_DEFAULT + (
-    'sAMAccountName', 'userAccountControl', 'memberOf')
+MANDATORY_PROPS_USER = MANDATORY_PROPS_DEFAULT | frozenset(
+    sys.intern(prop) for prop in (
+        'sAMAccountName', 'userAccountControl', 'memberOf'))
 
 # Default properties for Computer objects
-MANDATORY_PROPS_COMPUTER = MANDATORY_PROPS_USER + (
-    'servicePrincipalName', 'dNSHostname', 'operatingSystem',
-    'operatingSystemServicePack', 'operatingSystemVersion')
+MANDATORY_PROPS_COMPUTER = MANDATORY_PROPS_USER | frozenset(
+    sys.intern(prop) for prop in (
+        'servicePrincipalName', 'dNSHostName', 'operatingSystem',
+        'operatingSystemServicePack', 'operatingSystemVersion'))
 
 # Default properties for Group objects
-MANDATORY_PROPS_GROUP = MANDATORY_PROPS_DEFAULT + ('groupType',)
+MANDATORY_PROPS_GROUP = MANDATORY_PROPS_DEFAULT | frozenset(
+    sys.intern(prop) for prop in ('groupType', 'member'))
+
+# The number of objects requested per page of a paged search.
+PAGE_SIZE = 500
+
+# The largest number of values to OR together in a single ldap filter when
+# looking up many objects at once.  Larger batches are split into several
+# searches to stay under server limits.
+FILTER_BATCH_SIZE = 500
+
+# Characters that must be escaped in an ldap filter value (RFC 4515), as a
+# str.translate table mapping each to its \xx form.
+LDAP_FILTER_ESCAPES = {ord(c): '\\%02x' % ord(c) for c in '\\*()\x00'}
 
 # ADS_USER_FLAG_ENUM as listed by Microsoft.  It defines flags in the
 # userAccountControl bitmask.  Doing a bitwise AND between the
@@ -75,6 +94,16 @@ RE_HOSTNAME = re.compile('^[^.]+')
 RE_CN = re.compile('^CN=([^,]+)')
 RE_OU = re.compile('^OU=([^,]+)')
 
+# Splits a distinguishedName into its RDNs, skipping escaped commas
+RE_DN_SPLIT = re.compile(r'(?<!\\),(?=\s*[A-Za-z][\w-]*=)')
+
+# Splits an RDN into its attribute type and value
+RE_RDN = re.compile(r'^\s*([A-Za-z][\w-]*)=(.*)$')
+
+# Splits a ranged property name such as member;range=0-1499 into the property
+# name and the first and last value numbers.  The last is * for the final range.
+RE_RANGE = re.compile(r'^([^;]+);range=(\d+)-(\d+|\*)$', re.IGNORECASE)
+
 # Prefixes for objectCategory attributes to help with identifying objects
 CAT_USER = b'CN=Person,CN=Schema,'
 CAT_COMPUTER = b'CN=Computer,CN=Schema,'